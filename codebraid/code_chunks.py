@@ -344,7 +344,7 @@ class Options(dict):
 
     # The defaultdict handles unknown commands that are represented as None
     _default_rich_output = 'latex|markdown|png|jpg|svg|plain'.split('|')
-    _default_inline_show = collections.defaultdict(lambda: ODict(),  # Unknown -> show nothing
+    _default_inline_show = collections.defaultdict(ODict,  # Unknown -> show nothing
                                                    {'code':  ODict([('code', 'verbatim')]),
                                                     'expr':  ODict([('expr', 'raw'),
                                                                     ('stderr', 'verbatim')]),
@@ -360,7 +360,7 @@ class Options(dict):
                                                     'run':   ODict([('stdout', 'raw'),
                                                                     ('stderr', 'verbatim'),
                                                                     ('rich_output', _default_rich_output)])})
-    _default_block_show = collections.defaultdict(lambda: ODict(),  # Unknown -> show nothing
+    _default_block_show = collections.defaultdict(ODict,  # Unknown -> show nothing
                                                   {'code': ODict([('code', 'verbatim')]),
                                                    'nb':   ODict([('code', 'verbatim'),
                                                                   ('stdout', 'verbatim'),
@@ -867,7 +867,7 @@ class CodeChunk(object):
 
     commands = set(['code', 'expr', 'nb', 'paste', 'repl', 'run'])
 
-    _default_execute = collections.defaultdict(lambda: False,  # Unknown command -> do not run
+    _default_execute = collections.defaultdict(bool,  # Unknown command -> do not run
                                                {k: True for k in ('expr', 'nb', 'repl', 'run')})
 
 
@@ -40,7 +40,7 @@ class MetaConverter(type):
             # Subclass
             cls._registry[name.lower()] = cls
             if not all(attr is None or
-                       (isinstance(attr, set) and attr and all(isinstance(x, str) for x in attr))
+                       (isinstance(attr, (set, frozenset)) and attr and all(isinstance(x, str) for x in attr))
                        for attr in [cls.from_formats, cls.multi_origin_formats, cls.to_formats]):
                 raise TypeError
             if (cls.from_formats is not None and cls.multi_origin_formats is not None and
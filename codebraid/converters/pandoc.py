@@ -12,6 +12,8 @@ from __future__ import annotations
 
 
 import collections
+import concurrent.futures
+import functools
 import hashlib
 import json
 import os
@@ -23,6 +25,10 @@ import sys
 import tempfile
 import textwrap
 from typing import List, Optional, Sequence, Tuple, Union
+try:
+    import orjson
+except ImportError:
+    orjson = None
 from ..code_chunks import CodeChunk, Include
 from .. import err
 from .. import message
@@ -31,6 +37,23 @@ from ..codebraid_defaults import CodebraidDefaults
 from .base import Converter
 
 
+# Pandoc ASTs are serialized as JSON for every Pandoc invocation.  Use
+# `orjson` when available, since it is several times faster than `json` for
+# large ASTs.  Both functions work with UTF-8 bytes, which are passed to and
+# from Pandoc without any additional decoding.  With `json`, output is compact
+# like that from `orjson`, which significantly reduces the size of ASTs piped
+# to Pandoc.
+if orjson is not None:
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+else:
+    json_loads = json.loads
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode('utf8')
+
+
+
+
 # Pandoc node types mapped to integers representing the layout of node
 # contents (if any).
 # https://github.com/jgm/pandocfilters/blob/master/pandocfilters.py
@@ -74,6 +97,58 @@ pandoc_nodes = {**pandoc_block_nodes, **pandoc_inline_nodes}
 pandoc_code_nodes = {k: v for k, v in pandoc_nodes.items() if k.startswith('Code')}
 pandoc_raw_nodes = {k: v for k, v in pandoc_nodes.items() if k.startswith('Raw')}
 pandoc_code_raw_nodes = {**pandoc_code_nodes, **pandoc_raw_nodes}
+pandoc_code_span_nodes = {**pandoc_code_nodes, 'Span': pandoc_nodes['Span']}
+# Code and raw node types mapped to `(<is raw>, <is block>)`, so that a node
+# can be classified with a single lookup
+pandoc_code_raw_node_kinds = {k: (k.startswith('Raw'), k.endswith('Block')) for k in pandoc_code_raw_nodes}
+
+# Prefixes of classes that mark a code node as a Codebraid code chunk.  All
+# prefixes have the same length, so a class can be checked with a single
+# slice and set lookup.
+codebraid_class_prefixes = frozenset(['cb.', 'cb-'])
+
+# Platform affects Pandoc subprocess settings and the Pandoc data directory
+is_windows = platform.system() == 'Windows'
+
+# Version number in `pandoc --version` output
+pandoc_version_re = re.compile(rb'\d+\.\d+')
+# Pandoc versions that have already been determined, keyed by Pandoc path as
+# given, so that converters created later in the same process don't need to
+# run `pandoc --version` again
+pandoc_version_cache = {}
+
+# Key-value values that can be written as Markdown attributes without quoting.
+# This may need additional refinement in future depending on allowed values.
+unquoted_kv_value_re = re.compile(r'[A-Za-z$_+\-][A-Za-z0-9$_+\-:]*')
+
+# Trace info embedded in converted output, with format
+# `'\x02CodebraidTrace({0})\x03'`
+codebraid_trace_open = '\x02CodebraidTrace('
+codebraid_trace_close = ')\x03'
+codebraid_trace_re = re.compile(r'\x02CodebraidTrace\(.+?:\d+\)\x03')
+
+# Comment marking the end of each origin when multiple origins are
+# concatenated for a single Pandoc run.  It becomes a raw HTML block in the
+# AST, which marks where each origin ends.
+codebraid_eof_comment = '<!--codebraid.eof-->'
+
+# Runs of backticks in code, for finding the shortest Markdown code delimiter
+# that does not occur in the code
+backtick_run_re = re.compile(r'`+')
+
+# Node attributes `[<id>, <classes>, <kv pairs>]` for output nodes that don't
+# depend on the code chunk.  These are created once and then shared between
+# nodes, so they are tuples, which serialize to the same JSON as lists but
+# can't be modified.
+empty_attr = ('', (), ())
+single_class_attrs = util.KeyDefaultDict(lambda class_name: ('', (class_name,), ()))
+stderr_error_attr = ('', ('stderr', 'error'), ())
+
+# Attributes for frozen raw nodes, which are temporarily stored as code nodes
+# during intermediate AST conversions.  Without scroll sync, these only depend
+# on the raw format, so there is one shared, immutable attribute tuple per
+# format.
+frozen_raw_attrs = util.KeyDefaultDict(lambda raw_format: ('', ('codebraid--temp',), (('format', raw_format),)))
 
 
 
@@ -86,7 +161,10 @@ class PandocError(err.CodebraidError):
 
 def _get_class_processors():
     '''
-    Create dict mapping Pandoc classes to processing functions.
+    Create dict mapping Pandoc classes to processing functions.  Return the
+    dict plus the default processing function for classes not in the dict.
+    A plain dict is used rather than a `defaultdict`, so that lookups of
+    arbitrary classes such as language names don't add dict entries.
     '''
     def class_lang_or_unknown(code_chunk, options, class_index, class_name):
         if 'lang' in options:
@@ -129,15 +207,17 @@ def _get_class_processors():
     codebraid_commands.update({f'cb-{k}': class_codebraid_command for k in CodeChunk.commands})
     line_anchors = {k: class_line_anchors for k in ('lineAnchors', 'line-anchors', 'line_anchors')}
     line_numbers = {k: class_line_numbers for k in ('line_numbers', 'numberLines', 'number-lines', 'number_lines')}
-    return collections.defaultdict(lambda: class_lang_or_unknown,
-                                   {**codebraid_commands,
-                                    **line_anchors,
-                                    **line_numbers})
+    return ({**codebraid_commands,
+             **line_anchors,
+             **line_numbers},
+            class_lang_or_unknown)
 
 
 def _get_keyval_processors():
     '''
     Create dict mapping Pandoc key-value attributes to processing functions.
+    Return the dict plus the default processing function for keys not in the
+    dict, as for `_get_class_processors()`.
     '''
     # Options like `include` have sub-options, which need to be translated
     # into a dict.  In a markup language with more expressive option syntax,
@@ -229,22 +309,144 @@ def _get_keyval_processors():
     tab_size = {k: keyval_int for k in ['{0}_tab_size'.format(dsp) if dsp else 'tab_size'
                                          for dsp in ('', 'markup', 'copied_markup', 'code', 'stdout', 'stderr')]}
     namespace_keywords.add('include')
-    return collections.defaultdict(lambda: keyval_generic,
-                                   {'complete': keyval_bool,
-                                    'copy': keyval_generic,
-                                    'example': keyval_bool,
-                                    **expand_tabs,
-                                    **first_number,
-                                    **include,
-                                    'jupyter_timeout': keyval_int,
-                                    **line_anchors,
-                                    **line_numbers,
-                                    'live_output': keyval_bool,
-                                    'name': keyval_generic,
-                                    'outside_main': keyval_bool,
-                                    **rewrap_lines,
-                                    **rewrap_width,
-                                    **tab_size})
+    return ({'complete': keyval_bool,
+             'copy': keyval_generic,
+             'example': keyval_bool,
+             **expand_tabs,
+             **first_number,
+             **include,
+             'jupyter_timeout': keyval_int,
+             **line_anchors,
+             **line_numbers,
+             'live_output': keyval_bool,
+             'name': keyval_generic,
+             'outside_main': keyval_bool,
+             **rewrap_lines,
+             **rewrap_width,
+             **tab_size},
+            keyval_generic)
+
+
+def _get_output_node_makers():
+    '''
+    Create dict mapping `(<output>, <format>)` pairs from the `show` option to
+    functions that create the corresponding output node, or return None if
+    there is nothing to show.  Rich output is handled separately, since its
+    format is a list of formats.
+
+    Attributes that don't depend on the code chunk are shared between
+    nodes.
+    '''
+    markup_attr = single_class_attrs['markdown']
+    output_attrs = {output: single_class_attrs[output] for output in ('expr', 'stdout', 'stderr')}
+
+    def markup_verbatim(code_chunk, output, format, t_code, t_raw):
+        return {'t': t_code, 'c': [markup_attr, code_chunk.layout_output(output, format)]}
+
+    def markdown_raw(code_chunk, output, format, t_code, t_raw):
+        return {'t': t_raw, 'c': ['markdown', code_chunk.layout_output(output, format)]}
+
+    def code_verbatim(code_chunk, output, format, t_code, t_raw):
+        return {'t': t_code, 'c': [[code_chunk.pandoc_id, code_chunk.pandoc_classes, code_chunk.pandoc_kvpairs],
+                                   code_chunk.layout_output(output, format)]}
+
+    def repl_verbatim(code_chunk, output, format, t_code, t_raw):
+        if not code_chunk.repl_lines:
+            return None
+        return code_verbatim(code_chunk, output, format, t_code, t_raw)
+
+    def repl_raw(code_chunk, output, format, t_code, t_raw):
+        if not code_chunk.repl_lines:
+            return None
+        return markdown_raw(code_chunk, output, format, t_code, t_raw)
+
+    def output_verbatim(code_chunk, output, format, t_code, t_raw):
+        if not getattr(code_chunk, output+'_lines'):
+            return None
+        return output_verbatim_or_empty(code_chunk, output, format, t_code, t_raw)
+
+    def output_verbatim_or_empty(code_chunk, output, format, t_code, t_raw):
+        return {'t': t_code, 'c': [output_attrs[output], code_chunk.layout_output(output, format)]}
+
+    def output_raw(code_chunk, output, format, t_code, t_raw):
+        if not getattr(code_chunk, output+'_lines'):
+            return None
+        return markdown_raw(code_chunk, output, format, t_code, t_raw)
+
+    def stderr_error_lines(code_chunk):
+        stderr_output_lines = code_chunk.stderr_lines.copy()
+        for error in code_chunk.errors:
+            if error.is_ref and error.message:
+                stderr_output_lines.extend(error.message)
+        return stderr_output_lines
+
+    def stderr_verbatim(code_chunk, output, format, t_code, t_raw):
+        if not code_chunk.errors.has_stderr:
+            return output_verbatim(code_chunk, output, format, t_code, t_raw)
+        stderr_output_lines = stderr_error_lines(code_chunk)
+        if not stderr_output_lines:
+            return None
+        return {'t': t_code, 'c': [stderr_error_attr, code_chunk.layout_output(output, format, stderr_output_lines)]}
+
+    def stderr_verbatim_or_empty(code_chunk, output, format, t_code, t_raw):
+        if not code_chunk.errors.has_stderr:
+            return output_verbatim_or_empty(code_chunk, output, format, t_code, t_raw)
+        stderr_output_lines = stderr_error_lines(code_chunk)
+        return {'t': t_code, 'c': [stderr_error_attr, code_chunk.layout_output(output, format, stderr_output_lines)]}
+
+    def stderr_raw(code_chunk, output, format, t_code, t_raw):
+        if not code_chunk.errors.has_stderr:
+            return output_raw(code_chunk, output, format, t_code, t_raw)
+        if not code_chunk.stderr_lines:
+            return None
+        stderr_output_lines = stderr_error_lines(code_chunk)
+        return {'t': t_raw, 'c': ['markdown', code_chunk.layout_output(output, format, stderr_output_lines)]}
+
+    return {('markup', 'verbatim'): markup_verbatim,
+            ('markup', 'raw'): markdown_raw,
+            ('copied_markup', 'verbatim'): markup_verbatim,
+            ('copied_markup', 'raw'): markdown_raw,
+            ('code', 'verbatim'): code_verbatim,
+            ('code', 'raw'): markdown_raw,
+            ('repl', 'verbatim'): repl_verbatim,
+            ('repl', 'raw'): repl_raw,
+            **{(output, 'verbatim'): output_verbatim for output in ('expr', 'stdout')},
+            **{(output, 'verbatim_or_empty'): output_verbatim_or_empty for output in ('expr', 'stdout')},
+            **{(output, 'raw'): output_raw for output in ('expr', 'stdout')},
+            ('stderr', 'verbatim'): stderr_verbatim,
+            ('stderr', 'verbatim_or_empty'): stderr_verbatim_or_empty,
+            ('stderr', 'raw'): stderr_raw}
+
+
+def _max_backtick_run(code: str) -> int:
+    '''
+    Length of the longest run of backticks in code.  Markdown code delimiters
+    are created based on this, rather than being lengthened one step at a
+    time until they no longer occur in the code.
+    '''
+    if '`' not in code:
+        return 0
+    return max(len(run) for run in backtick_run_re.findall(code))
+
+
+@functools.lru_cache(maxsize=64)
+def _get_pandoc_classes(lang: Optional[str], repl: bool, line_anchors: bool, line_numbers: bool) -> Tuple[str, ...]:
+    '''
+    Create the Pandoc classes for displayed code.  Most code chunks in a
+    document share a few combinations of settings, so classes are cached and
+    shared between code chunks.  They are returned as a tuple so that they
+    can't be modified.
+    '''
+    pandoc_classes = []
+    if lang is not None:
+        pandoc_classes.append(lang)
+        if repl:
+            pandoc_classes.append('repl')
+    if line_anchors:
+        pandoc_classes.append('lineAnchors')
+    if line_numbers:
+        pandoc_classes.append('numberLines')
+    return tuple(pandoc_classes)
 
 
 
@@ -267,32 +469,37 @@ class PandocCodeChunk(CodeChunk):
         self.parent_node_list = parent_node_list
         self.parent_node_list_index = parent_node_list_index
 
-        node_id, node_classes, node_kvpairs = node['c'][0]
+        (node_id, node_classes, node_kvpairs), code = node['c']
         self.node_id = node_id if not node_id.startswith('codebraid-sourcepos') else ''
-        self.node_classes = node_classes
-        self.node_kvpairs = node_kvpairs
         self.node_sourcepos_id = node_id
-        self.node_sourcepos_classes = []
-        self.node_sourcepos_kvpairs = []
-        code = node['c'][1]
+        node_sourcepos_classes = []
+        node_sourcepos_kvpairs = []
         options = {}
 
         # Preprocess options
         inline = node['t'] == 'Code'
+        class_processors_get = self._class_processors.get
+        default_class_processor = self._default_class_processor
         for n, c in enumerate(node_classes):
             if c.startswith('codebraid-sourcepos'):
-                self.node_sourcepos_classes.append(c)
+                node_sourcepos_classes.append(c)
                 continue
-            self._class_processors[c](self, options, n, c)
-        if self.node_sourcepos_classes:
-            self.node_classes = [c for c in self.node_classes if not c.startswith('codebraid-sourcepos')]
+            class_processors_get(c, default_class_processor)(self, options, n, c)
+        if node_sourcepos_classes:
+            node_classes = [c for c in node_classes if not c.startswith('codebraid-sourcepos')]
+        kv_processors_get = self._kv_processors.get
+        default_kv_processor = self._default_kv_processor
         for k, v in node_kvpairs:
             if k.startswith('codebraid-sourcepos'):
-                self.node_sourcepos_kvpairs.append([k, v])
+                node_sourcepos_kvpairs.append([k, v])
                 continue
-            self._kv_processors[k](self, options, k, v)
-        if self.node_sourcepos_kvpairs:
-            self.node_kvpairs = [[k, v] for (k, v) in self.node_kvpairs if not k.startswith('codebraid-sourcepos')]
+            kv_processors_get(k, default_kv_processor)(self, options, k, v)
+        if node_sourcepos_kvpairs:
+            node_kvpairs = [[k, v] for (k, v) in node_kvpairs if not k.startswith('codebraid-sourcepos')]
+        self.node_classes = node_classes
+        self.node_kvpairs = node_kvpairs
+        self.node_sourcepos_classes = node_sourcepos_classes
+        self.node_sourcepos_kvpairs = node_sourcepos_kvpairs
         # All processed data from classes and key-value pairs is stored in
         # `options`, but only some of these are valid Codebraid options.
         # Remove those that are not and store in temp variables.
@@ -309,19 +516,12 @@ class PandocCodeChunk(CodeChunk):
                 self.source_errors.insert(0, 'Option "example" is only allowed for inline code that is in a paragraph by itself')
                 self.options['example'] = False
         pandoc_id = ''  # Could use node_id, but then must check duplication
-        pandoc_classes = []
-        pandoc_kvpairs = []
         lang = options.get('lang', None)
-        if lang is not None:
-            if lang.endswith('_repl'):
-                lang = lang.rsplit('_')[0]
-            pandoc_classes.append(lang)
-            if self.command == 'repl':
-                pandoc_classes.append('repl')
-        if line_anchors:
-            pandoc_classes.append('lineAnchors')
-        if self.options.get('code_line_numbers', False):
-            pandoc_classes.append('numberLines')
+        if lang is not None and lang.endswith('_repl'):
+            lang = lang.rsplit('_')[0]
+        pandoc_classes = _get_pandoc_classes(lang, self.command == 'repl', bool(line_anchors),
+                                             bool(self.options.get('code_line_numbers', False)))
+        pandoc_kvpairs = []
         # Can't handle `startFrom` yet here, because if it is `next`, then
         # the value depends on which other code chunks end up in the session.
         # Starting line number is determined when output is generated.
@@ -334,11 +534,11 @@ class PandocCodeChunk(CodeChunk):
         self._as_example_markup_lines = None
 
 
-    _class_processors = _get_class_processors()
-    _kv_processors = _get_keyval_processors()
-
-    # This may need additional refinement in future depending on allowed values
-    _unquoted_kv_value_re = re.compile(r'[A-Za-z$_+\-][A-Za-z0-9$_+\-:]*')
+    _class_processors, _default_class_processor = _get_class_processors()
+    _default_class_processor = staticmethod(_default_class_processor)
+    _kv_processors, _default_kv_processor = _get_keyval_processors()
+    _default_kv_processor = staticmethod(_default_kv_processor)
+    _output_node_makers = _get_output_node_makers()
 
 
     def finalize_line_numbers(self, code_start_line_number):
@@ -379,7 +579,8 @@ class PandocCodeChunk(CodeChunk):
 
     def finalize_after_copy(self):
         if self.options['lang'] is None:
-            self.pandoc_classes.insert(0, self.copy_chunks[0].options['lang'])
+            # `pandoc_classes` may be shared, so it is replaced, not modified
+            self.pandoc_classes = (self.copy_chunks[0].options['lang'], *self.pandoc_classes)
         self.options.finalize_after_copy()
 
 
@@ -387,7 +588,8 @@ class PandocCodeChunk(CodeChunk):
     def output_nodes(self):
         '''
         A list of nodes representing output, or representing source errors if
-        those prevented execution.
+        those prevented execution.  Nodes are only created once, including
+        for errors, since this may be accessed multiple times.
         '''
         if self._output_nodes is not None:
             return self._output_nodes
@@ -410,6 +612,7 @@ class PandocCodeChunk(CodeChunk):
                     nodes.append({'t': 'Code', 'c': [['', error_class_list, []], ' '.join(msgs_list)]})
                 else:
                     nodes.append({'t': 'CodeBlock', 'c': [['', error_class_list, []], '\n'.join(msgs_list)]})
+                self._output_nodes = nodes
                 return nodes
         if self.errors.has_non_stderr:
             msgs_list = []
@@ -428,62 +631,17 @@ class PandocCodeChunk(CodeChunk):
                 nodes.append({'t': 'Code', 'c': [['', error_class_list, []], ' '.join(msgs_list)]})
             else:
                 nodes.append({'t': 'CodeBlock', 'c': [['', error_class_list, []], '\n'.join(msgs_list)]})
+            self._output_nodes = nodes
+            return nodes
+        if not self.options['show']:
+            self._output_nodes = nodes
             return nodes
         t_code = 'Code' if self.inline else 'CodeBlock'
         t_raw = 'RawInline' if self.inline else 'RawBlock'
         unformatted_nodes = []
+        output_node_makers = self._output_node_makers
         for output, format in self.options['show'].items():
-            if output in ('markup', 'copied_markup'):
-                if format == 'verbatim':
-                    unformatted_nodes.append({'t': t_code, 'c': [['', ['markdown'], []], self.layout_output(output, format)]})
-                elif format == 'raw':
-                    unformatted_nodes.append({'t': t_raw, 'c': ['markdown', self.layout_output(output, format)]})
-                else:
-                    raise ValueError
-            elif output == 'code':
-                if format == 'verbatim':
-                    unformatted_nodes.append({'t': t_code, 'c': [[self.pandoc_id, self.pandoc_classes, self.pandoc_kvpairs], self.layout_output(output, format)]})
-                elif format == 'raw':
-                    unformatted_nodes.append({'t': t_raw, 'c': ['markdown', self.layout_output(output, format)]})
-                else:
-                    raise ValueError
-            elif output == 'repl':
-                if not self.repl_lines:
-                    continue
-                if format == 'verbatim':
-                    unformatted_nodes.append({'t': t_code, 'c': [[self.pandoc_id, self.pandoc_classes, self.pandoc_kvpairs], self.layout_output(output, format)]})
-                elif format == 'raw':
-                    unformatted_nodes.append({'t': t_raw, 'c': ['markdown', self.layout_output(output, format)]})
-                else:
-                    raise ValueError
-            elif output in ('expr', 'stdout', 'stderr'):
-                if output == 'stderr' and self.errors.has_stderr:
-                    stderr_output_lines = self.stderr_lines.copy()
-                    for error in self.errors:
-                        if error.is_ref and error.message:
-                            stderr_output_lines.extend(error.message)
-                    if format == 'verbatim':
-                        if stderr_output_lines:
-                            unformatted_nodes.append({'t': t_code, 'c': [['', ['stderr', 'error'], []], self.layout_output(output, format, stderr_output_lines)]})
-                    elif format == 'verbatim_or_empty':
-                        unformatted_nodes.append({'t': t_code, 'c': [['', ['stderr', 'error'], []], self.layout_output(output, format, stderr_output_lines)]})
-                    elif format == 'raw':
-                        if getattr(self, output+'_lines'):
-                            unformatted_nodes.append({'t': t_raw, 'c': ['markdown', self.layout_output(output, format, stderr_output_lines)]})
-                    else:
-                        raise ValueError
-                    continue
-                if format == 'verbatim':
-                    if getattr(self, output+'_lines'):
-                        unformatted_nodes.append({'t': t_code, 'c': [['', [output], []], self.layout_output(output, format)]})
-                elif format == 'verbatim_or_empty':
-                    unformatted_nodes.append({'t': t_code, 'c': [['', [output], []], self.layout_output(output, format)]})
-                elif format == 'raw':
-                    if getattr(self, output+'_lines'):
-                        unformatted_nodes.append({'t': t_raw, 'c': ['markdown', self.layout_output(output, format)]})
-                else:
-                    raise ValueError
-            elif output == 'rich_output':
+            if output == 'rich_output':
                 if not self.rich_output:
                     continue
                 for ro in self.rich_output:
@@ -499,7 +657,7 @@ class PandocCodeChunk(CodeChunk):
                         if fmt_mime_type not in ro_data:
                             continue
                         if fmt_mime_type in ro_files:
-                            image_node = {'t': 'Image', 'c': [['', ['richOutput'], []], [], [ro_files[fmt_mime_type], '']]}
+                            image_node = {'t': 'Image', 'c': [single_class_attrs['richOutput'], [], [ro_files[fmt_mime_type], '']]}
                             if self.inline:
                                 unformatted_nodes.append(image_node)
                             else:
@@ -517,9 +675,9 @@ class PandocCodeChunk(CodeChunk):
                                 unformatted_nodes.append({'t': t_raw, 'c': [raw_fmt, self.layout_output(output, 'raw', lines)]})
                             elif fmt_text_display == 'verbatim':
                                 if lines:
-                                    unformatted_nodes.append({'t': t_code, 'c': [['', [fmt], []], self.layout_output(output, 'verbatim', lines)]})
+                                    unformatted_nodes.append({'t': t_code, 'c': [single_class_attrs[fmt], self.layout_output(output, 'verbatim', lines)]})
                             elif fmt_text_display == 'verbatim_or_empty':
-                                unformatted_nodes.append({'t': t_code, 'c': [['', [fmt], []], self.layout_output(output, 'verbatim', lines)]})
+                                unformatted_nodes.append({'t': t_code, 'c': [single_class_attrs[fmt], self.layout_output(output, 'verbatim', lines)]})
                             else:
                                 raise ValueError
                             break
@@ -528,19 +686,28 @@ class PandocCodeChunk(CodeChunk):
                                 unformatted_nodes.append({'t': t_raw, 'c': ['markdown', self.layout_output(output, fmt_text_display, lines)]})
                             elif fmt_text_display == 'verbatim':
                                 if lines:
-                                    unformatted_nodes.append({'t': t_code, 'c': [['', [], []], self.layout_output(output, 'verbatim', lines)]})
+                                    unformatted_nodes.append({'t': t_code, 'c': [empty_attr, self.layout_output(output, 'verbatim', lines)]})
                             elif fmt_text_display == 'verbatim_or_empty':
-                                unformatted_nodes.append({'t': t_code, 'c': [['', [], []], self.layout_output(output, 'verbatim', lines)]})
+                                unformatted_nodes.append({'t': t_code, 'c': [empty_attr, self.layout_output(output, 'verbatim', lines)]})
                             else:
                                 raise ValueError
                             break
                         raise ValueError
-            else:
+                continue
+            try:
+                make_output_node = output_node_makers[(output, format)]
+            except KeyError:
                 raise ValueError
-        if unformatted_nodes:
+            node = make_output_node(self, output, format, t_code, t_raw)
+            if node is not None:
+                unformatted_nodes.append(node)
+        if len(unformatted_nodes) == 1:
+            # Typical case:  a single node needs no separators
+            nodes = unformatted_nodes
+        elif unformatted_nodes:
             # Prevent adjacent nodes from merging unintentionally when
             # converted through intermediate Markdown
-            for node, next_node in zip(unformatted_nodes[:-1], unformatted_nodes[1:]):
+            for node, next_node in zip(unformatted_nodes, unformatted_nodes[1:]):
                 nodes.append(node)
                 if node['t'] == t_raw or next_node['t'] == t_raw:
                     if self.inline:
@@ -575,19 +742,22 @@ class PandocCodeChunk(CodeChunk):
         show Markdown source plus output.
         '''
         attr_list = []
+        attr_list_append = attr_list.append
         if self.node_id:
-            attr_list.append('#{0}'.format(self.node_id))
+            attr_list_append('#{0}'.format(self.node_id))
         for c in self.node_classes:
-            attr_list.append('.{0}'.format(c))
+            attr_list_append('.{0}'.format(c))
         hide_keys = set(self.options.get('hide_markup_keys', []))
         if example:
             hide_keys.add('example')
+        unquoted_kv_value_match = unquoted_kv_value_re.match
         for k, v in self.node_kvpairs:
             if k not in hide_keys:
                 # Valid keys don't need quoting, some values may
-                if not self._unquoted_kv_value_re.match(v):
+                if not unquoted_kv_value_match(v):
                     v = '"{0}"'.format(v.replace('\\', '\\\\').replace('"', '\\"'))
-                attr_list.append('{0}={1}'.format(k, v))
+                attr_list_append('{0}={1}'.format(k, v))
+        attrs = ' '.join(attr_list)
         if self.placeholder_code_lines:
             code_lines = self.placeholder_code_lines
             code_str = code_lines[0]
@@ -600,17 +770,13 @@ class PandocCodeChunk(CodeChunk):
                 code_str = ' ' + code_str
             if code_strip.endswith('`'):
                 code_str = code_str + ' '
-            delim = '`'
-            while delim in code_str:
-                delim += '`'
-            md_lines = ['{delim}{code}{delim}{{{attr}}}'.format(delim=delim, code=code_str, attr=' '.join(attr_list))]
+            delim = '`' * (_max_backtick_run(code_str) + 1)
+            md_lines = [f'{delim}{code_str}{delim}{{{attrs}}}']
         elif not self.placeholder_code_lines or code_str:
-            delim = '```'
-            while delim in code_str:
-                delim += '```'
-            md_lines = ['{delim}{{{attr}}}'.format(delim=delim, attr=' '.join(attr_list)), *code_lines, delim]
+            delim = '```' * (_max_backtick_run(code_str) // 3 + 1)
+            md_lines = [f'{delim}{{{attrs}}}', *code_lines, delim]
         else:
-            md_lines = ['```{{{attr}}}'.format(attr=' '.join(attr_list)), '```']
+            md_lines = [f'```{{{attrs}}}', '```']
         return md_lines
 
 
@@ -787,9 +953,7 @@ class PandocCodeChunk(CodeChunk):
         md_list = []
         if protect_start:
             md_list.append('[]{.codebraid-protect-inline=true}')
-        delim = '`'
-        while delim in text:
-            delim += '`'
+        delim = '`' * (_max_backtick_run(text) + 1)
         md_list.append(delim)
         if text.startswith(' ') and text.endswith(' '):  # https://spec.commonmark.org/0.30/#code-spans
             md_list.append(f'{delim} {text} {delim}')
@@ -807,9 +971,7 @@ class PandocCodeChunk(CodeChunk):
 
     def _as_markdown_block_code(self, text: str, *, id=None, classes=None, keyval=None, raw=None):
         md_list = []
-        delim = '```'
-        while delim in text:
-            delim += '```'
+        delim = '```' * (_max_backtick_run(text) // 3 + 1)
         md_list.append(f'{delim}{self._as_markdown_attr(id, classes, keyval, raw)}\n')
         md_list.append(text)
         if not text.endswith('\n'):
@@ -832,29 +994,33 @@ class PandocCodeChunk(CodeChunk):
         return f'![{alt}]({path}){self._as_markdown_attr(id, classes, keyval)}'
 
 
-    def update_parent_node(self):
+    def update_parent_node(self, index_offset: int=0) -> int:
         '''
         Update parent node with output.
+
+        `index_offset` is the number of nodes that have already been added to
+        the parent node list by updates from earlier code chunks in the same
+        list.  Return the number of nodes added to the parent node list by
+        this update.
         '''
         if not self.options['example']:
-            index = self.parent_node_list_index
-            if self.inline or (not self.node_sourcepos_classes and not self.node_sourcepos_kvpairs):
-                output_nodes = self.output_nodes
-            else:
-                output_nodes =  [{'t': 'Div', 'c': [[self.node_sourcepos_id, self.node_sourcepos_classes, self.node_sourcepos_kvpairs], self.output_nodes]}]
+            index = self.parent_node_list_index + index_offset
+            output_nodes = self.output_nodes
+            if not self.inline and (self.node_sourcepos_classes or self.node_sourcepos_kvpairs):
+                output_nodes =  [{'t': 'Div', 'c': [[self.node_sourcepos_id, self.node_sourcepos_classes, self.node_sourcepos_kvpairs], output_nodes]}]
             self.parent_node_list[index:index+1] = output_nodes
-            return
-        markup_node = {'t': 'CodeBlock', 'c': [['', [], []], self.layout_output('example_markup', 'verbatim')]}
-        example_div_contents = [{'t': 'Div', 'c': [['', ['exampleMarkup'], []], [markup_node]]}]
+            return len(output_nodes) - 1
+        markup_node = {'t': 'CodeBlock', 'c': [empty_attr, self.layout_output('example_markup', 'verbatim')]}
+        example_div_contents = [{'t': 'Div', 'c': [single_class_attrs['exampleMarkup'], [markup_node]]}]
         output_nodes = self.output_nodes
         if output_nodes:
             if self.inline:
                 # `output_nodes` are all inline, but will be inserted into a
                 # div, so need a block-level wrapper
                 output_nodes = [{'t': 'Para', 'c': output_nodes}]
-            example_div_contents.append({'t': 'Div', 'c': [['', ['exampleOutput'], []], output_nodes]})
+            example_div_contents.append({'t': 'Div', 'c': [single_class_attrs['exampleOutput'], output_nodes]})
         if self.inline or (not self.node_sourcepos_classes and not self.node_sourcepos_kvpairs):
-            example_div_node = {'t': 'Div', 'c': [['', ['example'], []], example_div_contents]}
+            example_div_node = {'t': 'Div', 'c': [single_class_attrs['example'], example_div_contents]}
         else:
             example_div_node = {'t': 'Div', 'c': [[self.node_sourcepos_id, ['example', *self.node_sourcepos_classes], self.node_sourcepos_kvpairs], example_div_contents]}
         if self.inline:
@@ -865,21 +1031,31 @@ class PandocCodeChunk(CodeChunk):
             parent_para_plain_node['t'] = 'Div'
             parent_para_plain_node['c'] = example_div_node['c']
         else:
-            index = self.parent_node_list_index
+            index = self.parent_node_list_index + index_offset
             self.parent_node_list[index] = example_div_node
+        return 0
+
 
 
 
+# Nodes whose contents never contain other nodes.  `Str` is by far the most
+# common node, and code and raw nodes have list contents (attributes and
+# formats) that would otherwise be walked in search of child nodes.
+leaf_node_types = frozenset({'Str', 'Space', 'SoftBreak', 'LineBreak', 'HorizontalRule',
+                             'Code', 'CodeBlock', 'RawInline', 'RawBlock'})
 
-def _get_walk_closure(enumerate=enumerate, isinstance=isinstance, list=list, dict=dict):
+def _get_walk_closure(enumerate=enumerate, isinstance=isinstance, list=list, dict=dict,
+                      leaf_node_types=leaf_node_types):
     def walk_node_list(node_list, parent_node, type_filter=None, skip_note_contents=False, in_note=False):
         '''
-        Walk all AST nodes in a list, recursively descending to walk all child
-        nodes as well.  The walk function is written so that it is only ever
-        called on lists, reducing recursion depth and reducing the number of
-        times the walk function is called.  Thus, it is never called on `Str`
-        nodes and other leaf nodes, which will typically make up the vast
-        majority of nodes.
+        Walk all AST nodes in a list, descending to walk all child nodes as
+        well.  Rather than recursing, the walk keeps an explicit stack of
+        frames, one for each list currently being walked.  This avoids
+        creating a generator for every nested list and resuming a chain of
+        generators for every yield, and it is not limited by recursion depth.
+        Only lists are ever pushed onto the stack, so `Str` nodes and other
+        leaf nodes, which will typically make up the vast majority of nodes,
+        never require a frame.
 
         DefinitionLists are handled specially to wrap terms in fake Plain
         nodes, which are marked so that they can be identified later if
@@ -893,36 +1069,66 @@ def _get_walk_closure(enumerate=enumerate, isinstance=isinstance, list=list, dic
         supports membership checks via `in`.  Only nodes with types in
         `type_filter` will be yielded.
 
-        If `skip_notes` is true, recursion skips nodes inside notes.
+        If `skip_note_contents` is true, the walk skips nodes inside notes.
         '''
-        for index, obj in enumerate(node_list):
-            if isinstance(obj, dict):
-                try:
-                    node_type = obj['t']
-                except KeyError:
-                    continue
-                if type_filter is None or node_type in type_filter:
-                    yield (obj, parent_node, node_list, index, in_note)
-                if 'c' in obj:
-                    obj_contents = obj['c']
-                    if isinstance(obj_contents, list):
-                        if node_type == 'Note':
-                            if skip_note_contents:
-                                continue
-                            in_note = True
-                            yield from walk_node_list(obj_contents, obj, type_filter, skip_note_contents, in_note)
-                        elif node_type != 'DefinitionList':
-                            yield from walk_node_list(obj_contents, obj, type_filter, skip_note_contents, in_note)
-                        else:
-                            for elem in obj_contents:
-                                term, definition = elem
-                                pseudonode = {'t': 'Plain', 'c': term, 'codebraid_pseudonode': True}
-                                if type_filter is None or 'Plain' in type_filter:
-                                    yield (pseudonode, obj, elem, 0, in_note)
-                                yield from walk_node_list(term, pseudonode, type_filter, skip_note_contents, in_note)
-                                yield from walk_node_list(definition, obj, type_filter, skip_note_contents, in_note)
-            elif isinstance(obj, list):
-                yield from walk_node_list(obj, parent_node, type_filter, skip_note_contents, in_note)
+        # The stack holds the state for each list whose walk is suspended
+        # while a child list is walked:
+        #   (<iterator over enumerated list>, <list>, <parent node>, <in note>)
+        # The iterator retains its position, so the walk resumes with the
+        # next item in the list once the frame is popped.
+        stack = []
+        node_list_iter = enumerate(node_list)
+        while True:
+            for index, obj in node_list_iter:
+                if isinstance(obj, dict):
+                    try:
+                        node_type = obj['t']
+                    except KeyError:
+                        continue
+                    if type_filter is None or node_type in type_filter:
+                        yield (obj, parent_node, node_list, index, in_note)
+                    if node_type in leaf_node_types:
+                        continue
+                    if 'c' in obj:
+                        obj_contents = obj['c']
+                        if isinstance(obj_contents, list):
+                            if node_type == 'Note':
+                                if skip_note_contents:
+                                    continue
+                                stack.append((node_list_iter, node_list, parent_node, in_note))
+                                node_list_iter = enumerate(obj_contents)
+                                node_list = obj_contents
+                                parent_node = obj
+                                in_note = True
+                                break
+                            elif node_type != 'DefinitionList':
+                                stack.append((node_list_iter, node_list, parent_node, in_note))
+                                node_list_iter = enumerate(obj_contents)
+                                node_list = obj_contents
+                                parent_node = obj
+                                break
+                            else:
+                                # Push frames in reverse so that they are
+                                # walked in order.  Each term is walked as the
+                                # contents of a pseudonode, which is itself
+                                # yielded from a single-item frame.
+                                stack.append((node_list_iter, node_list, parent_node, in_note))
+                                for elem in reversed(obj_contents):
+                                    term, definition = elem
+                                    pseudonode = {'t': 'Plain', 'c': term, 'codebraid_pseudonode': True}
+                                    stack.append((enumerate(definition), definition, obj, in_note))
+                                    stack.append((iter([(0, pseudonode)]), elem, obj, in_note))
+                                node_list_iter, node_list, parent_node, in_note = stack.pop()
+                                break
+                elif isinstance(obj, list):
+                    stack.append((node_list_iter, node_list, parent_node, in_note))
+                    node_list_iter = enumerate(obj)
+                    node_list = obj
+                    break
+            else:
+                if not stack:
+                    return
+                node_list_iter, node_list, parent_node, in_note = stack.pop()
     return walk_node_list
 walk_node_list = _get_walk_closure()
 
@@ -960,18 +1166,33 @@ class PandocConverter(Converter):
                 pandoc_path = pathlib.Path(os.path.expandvars(pandoc_path))
             if self.expanduser:
                 pandoc_path = pandoc_path.expanduser()
-        try:
-            proc = subprocess.run([str(pandoc_path), '--version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-        except FileNotFoundError:
-            raise RuntimeError('Pandoc path "{0}" does not exist'.format(pandoc_path))
-        pandoc_version_match = re.search(rb'\d+\.\d+', proc.stdout)
-        if not pandoc_version_match:
-            raise RuntimeError('Could not determine Pandoc version from "{0} --version"; faulty Pandoc installation?'.format(pandoc_path))
-        pandoc_version_major, pandoc_version_minor = (int(x) for x in pandoc_version_match.group().split(b'.', 1))
-        if pandoc_version_major < 2 or (pandoc_version_major == 2 and pandoc_version_minor < 4):
-            raise RuntimeError('Pandoc at "{0}" is version {1}.{2}, but >= 2.4 is required'.format(pandoc_path, pandoc_version_major, pandoc_version_minor))
+        pandoc_version_cache_key = str(pandoc_path)
+        if pandoc_version_cache_key in pandoc_version_cache:
+            self.pandoc_version = pandoc_version_cache[pandoc_version_cache_key]
+        else:
+            try:
+                proc = subprocess.run([str(pandoc_path), '--version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+            except FileNotFoundError:
+                raise RuntimeError('Pandoc path "{0}" does not exist'.format(pandoc_path))
+            pandoc_version_match = pandoc_version_re.search(proc.stdout)
+            if not pandoc_version_match:
+                raise RuntimeError('Could not determine Pandoc version from "{0} --version"; faulty Pandoc installation?'.format(pandoc_path))
+            pandoc_version_major, pandoc_version_minor = (int(x) for x in pandoc_version_match.group().split(b'.', 1))
+            if pandoc_version_major < 2 or (pandoc_version_major == 2 and pandoc_version_minor < 4):
+                raise RuntimeError('Pandoc at "{0}" is version {1}.{2}, but >= 2.4 is required'.format(pandoc_path, pandoc_version_major, pandoc_version_minor))
+            self.pandoc_version = (pandoc_version_major, pandoc_version_minor)
+            pandoc_version_cache[pandoc_version_cache_key] = self.pandoc_version
         self.pandoc_path = pandoc_path
-        if platform.system() == 'Windows':
+        # Pandoc subprocess settings that are the same for every invocation
+        self._pandoc_path_str = str(pandoc_path)
+        if is_windows:
+            # Prevent console from appearing for an instant
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            self._pandoc_startupinfo = startupinfo
+        else:
+            self._pandoc_startupinfo = None
+        if is_windows:
             pandoc_template_path = pathlib.Path('~/AppData/Roaming/pandoc/templates').expanduser()
         else:
             pandoc_data_path = pathlib.Path(os.environ.get('XDG_DATA_HOME', '~/.local/share')).expanduser() / 'pandoc'
@@ -1000,20 +1221,25 @@ class PandocConverter(Converter):
         self.pandoc_file_scope = pandoc_file_scope
         self.other_pandoc_args_at_load = other_pandoc_args_at_load
 
-        if self.from_format == 'markdown' and not pandoc_file_scope and len(self.origins) > 1:
-            # If multiple files are being passed to Pandoc for concatenated
-            # processing, ensure sufficient whitespace to prevent elements in
-            # different files from merging, and insert a comment to prevent
-            # indented elements from merging.  This means that the original
-            # sources cannot be passed to Pandoc directly.
-            for origin_name, origin_string in self.origins.items():
-                if origin_string[-1:] == '\n':
-                    origin_string += '\n<!--codebraid.eof-->\n\n'
-                else:
-                    origin_string += '\n\n<!--codebraid.eof-->\n\n'
-                self.origins[origin_name] = origin_string
         if not pandoc_file_scope and len(self.origins) > 1:
-            self.concat_origin_string = ''.join(self.origins.values())
+            if self.from_format == 'markdown':
+                # If multiple files are being passed to Pandoc for
+                # concatenated processing, ensure sufficient whitespace to
+                # prevent elements in different files from merging, and insert
+                # a comment to prevent indented elements from merging.  This
+                # means that the original sources cannot be passed to Pandoc
+                # directly.  The separators are interleaved with the sources
+                # and joined once, rather than appended to each source.
+                concat_origin_parts = []
+                for origin_string in self.origins.values():
+                    concat_origin_parts.append(origin_string)
+                    if origin_string[-1:] == '\n':
+                        concat_origin_parts.append(f'\n{codebraid_eof_comment}\n\n')
+                    else:
+                        concat_origin_parts.append(f'\n\n{codebraid_eof_comment}\n\n')
+                self.concat_origin_string = ''.join(concat_origin_parts)
+            else:
+                self.concat_origin_string = ''.join(self.origins.values())
 
         self.from_format_pandoc_extensions = from_format_pandoc_extensions
 
@@ -1027,12 +1253,13 @@ class PandocConverter(Converter):
         self._asts = {}
         self._para_plain_origin_name_node_line_number = []
         self._final_ast = None
+        self._final_ast_bytes = None
 
         self.codebraid_defaults.update_from_yaml_metadata(next(iter(self.origins.values())))
 
 
-    from_formats = set(['markdown', 'commonmark_x'])
-    multi_origin_formats = set(['markdown', 'commonmark_x'])
+    from_formats = frozenset(['markdown', 'commonmark_x'])
+    multi_origin_formats = frozenset(['markdown', 'commonmark_x'])
     to_formats = None
 
 
@@ -1051,11 +1278,10 @@ class PandocConverter(Converter):
 
     # Node sets are based on pandocfilters
     # https://github.com/jgm/pandocfilters/blob/master/pandocfilters.py
-    _null_block_node_type = set([''])
-    _block_node_types = set(['Plain', 'Para', 'CodeBlock', 'RawBlock',
-                             'BlockQuote', 'OrderedList', 'BulletList',
-                             'DefinitionList', 'Header', 'HorizontalRule',
-                             'Table', 'Div']) | _null_block_node_type
+    _block_node_types = frozenset(['Plain', 'Para', 'CodeBlock', 'RawBlock',
+                                   'BlockQuote', 'OrderedList', 'BulletList',
+                                   'DefinitionList', 'Header', 'HorizontalRule',
+                                   'Table', 'Div', ''])
 
 
     def _run_pandoc(self, *,
@@ -1075,7 +1301,9 @@ class PandocConverter(Converter):
         '''
         Convert between formats using Pandoc.
 
-        Communication with Pandoc is accomplished via pipes.
+        Communication with Pandoc is accomplished via pipes.  If
+        `output_path` is provided, Pandoc writes directly to the file, so
+        stdout is not captured and the returned stdout is empty.
         '''
         if from_format_pandoc_extensions is None:
             from_format_pandoc_extensions = ''
@@ -1083,7 +1311,7 @@ class PandocConverter(Converter):
             to_format_pandoc_extensions = ''
         if input and input_paths:
             raise TypeError
-        cmd_list = [str(self.pandoc_path),
+        cmd_list = [self._pandoc_path_str,
                     '--from', from_format + from_format_pandoc_extensions]
         if newline_lf:
             cmd_list.extend(['--eol', 'lf'])
@@ -1121,22 +1349,21 @@ class PandocConverter(Converter):
             else:
                 cmd_list.extend([p.as_posix() for p in input_paths])
 
-        if platform.system() == 'Windows':
-            # Prevent console from appearing for an instant
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        else:
-            startupinfo = None
-
         if isinstance(input, str):
             input = input.encode('utf8')
 
+        if output_path is not None:
+            # Pandoc writes directly to the output file
+            stdout = subprocess.DEVNULL
+        else:
+            stdout = subprocess.PIPE
+
         try:
             proc = subprocess.run(cmd_list,
                                   input=input,
-                                  stdout=subprocess.PIPE,
+                                  stdout=stdout,
                                   stderr=subprocess.PIPE,
-                                  startupinfo=startupinfo, check=True)
+                                  startupinfo=self._pandoc_startupinfo, check=True)
         except subprocess.CalledProcessError as e:
             if input_paths is not None and input_name is None:
                 if isinstance(input_paths, pathlib.Path):
@@ -1148,7 +1375,8 @@ class PandocConverter(Converter):
             else:
                 message = 'Failed to run Pandoc on source(s) {0}:\n{1}'.format(input_name, e.stderr.decode('utf8'))
             raise PandocError(message)
-        return (proc.stdout, proc.stderr)
+        # With `output_path`, stdout isn't captured and is None
+        return (proc.stdout or b'', proc.stderr)
 
 
     _walk_node_list = staticmethod(walk_node_list)
@@ -1156,24 +1384,32 @@ class PandocConverter(Converter):
     def _walk_ast(self, ast, type_filter=None, skip_note_contents=False):
         '''
         Walk all nodes in AST.
+
+        The walker is returned directly rather than wrapped in another
+        generator, so that each node doesn't pass through an extra level of
+        `yield from`.
         '''
         ast_root_node_list = ast['blocks']
-        yield from self._walk_node_list(ast_root_node_list, ast, type_filter=type_filter, skip_note_contents=skip_note_contents)
+        return self._walk_node_list(ast_root_node_list, ast, type_filter=type_filter, skip_note_contents=skip_note_contents)
 
 
     @staticmethod
-    def _io_map_span_node(origin_name, line_number):
+    def _io_map_span_node(origin_name, line_number,
+                          temp_classes=['codebraid--temp']):
         '''
         Create an empty span node containing source name and line number as
         attributes.  This is used to attach source info to an AST location,
         and then track that location through AST transformations and
         conversions.
+
+        All span nodes share the same class list, which is never modified, so
+        only the trace attribute must be created for each node.
         '''
         span_node = {'t': 'Span',
                      'c': [
                               [
                                   '',  # id
-                                  ['codebraid--temp'],  # classes
+                                  temp_classes,  # classes
                                   [['trace', '{0}:{1}'.format(origin_name, line_number)]]  # kv pairs
                               ],
                               []  # contents
@@ -1184,31 +1420,27 @@ class PandocConverter(Converter):
     @staticmethod
     def _io_map_span_node_to_raw_tracker(span_node):
         span_node['t'] = 'RawInline'
-        span_node['c'] = [None, '\x02CodebraidTrace({0})\x03'.format(span_node['c'][0][2][0][1])]
+        span_node['c'] = [None, f"{codebraid_trace_open}{span_node['c'][0][2][0][1]}{codebraid_trace_close}"]
 
 
     @staticmethod
     def _freeze_raw_node(node, origin_name, line_number,
-                         type_translation_dict={'RawBlock': 'CodeBlock', 'RawInline': 'Code'}):
+                         type_translation_dict={'RawBlock': 'CodeBlock', 'RawInline': 'Code'},
+                         frozen_raw_attrs=frozen_raw_attrs):
         '''
         Convert a raw node into a special code node.  This prevents the raw
         node from being prematurely interpreted/discarded during intermediate
-        AST transformations.
+        AST transformations.  Attributes only depend on the raw format, so
+        they are shared between nodes.
         '''
         node['t'] = type_translation_dict[node['t']]
         raw_format, raw_content = node['c']
-        node['c'] = [
-                        [
-                            '',  # id
-                            ['codebraid--temp'],  # classes
-                            [['format', raw_format]],  # kv pairs
-                        ],
-                        raw_content
-                    ]
+        node['c'] = [frozen_raw_attrs[raw_format], raw_content]
 
     @staticmethod
     def _freeze_raw_node_io_map(node, origin_name, line_number,
-                                type_translation_dict={'RawBlock': 'CodeBlock', 'RawInline': 'Code'}):
+                                type_translation_dict={'RawBlock': 'CodeBlock', 'RawInline': 'Code'},
+                                temp_classes=['codebraid--temp']):
         '''
         Same as `_freeze_raw_node()`, but also store trace info.
         '''
@@ -1217,8 +1449,8 @@ class PandocConverter(Converter):
         node['c'] = [
                         [
                             '',  # id
-                            ['codebraid--temp'],  # classes
-                            [['format', raw_format], ['trace', '{0}:{1}'.format(origin_name, line_number)]]  # kv pairs
+                            temp_classes,  # classes
+                            [['format', raw_format], ['trace', f'{origin_name}:{line_number}']]  # kv pairs
                         ],
                         raw_content
                     ]
@@ -1246,7 +1478,7 @@ class PandocConverter(Converter):
                 trace = v
             else:
                 raise ValueError
-        node['c'] = [raw_format, '\x02CodebraidTrace({0})\x03'.format(trace) + node['c'][1]]
+        node['c'] = [raw_format, f"{codebraid_trace_open}{trace}{codebraid_trace_close}{node['c'][1]}"]
 
 
     @staticmethod
@@ -1254,7 +1486,7 @@ class PandocConverter(Converter):
             text: str,
             *,
             from_format: str,
-            max_command_len=max(len(x) for x in CodeChunk.commands),
+            command_end_re=re.compile(r'[^}} \t\n]{{0,{0}}}[}} \t\n]'.format(max(len(x) for x in CodeChunk.commands))),
             commands_set=CodeChunk.commands,
             before_attr_chars=set('{ \t\n'),
             after_attr_chars=set('} \t\n')
@@ -1275,30 +1507,34 @@ class PandocConverter(Converter):
         if not from_format.startswith('commonmark_x'):
             command_prefixes['.cb.'] = True
         results = []
+        # Bind methods used in the loop to locals, since there may be many
+        # occurrences in a long document
+        text_find = text.find
+        text_count = text.count
+        command_end_match = command_end_re.match
+        results_append = results.append
         line_num = 1
         start_index = 0
         while True:
             maybe_start_cb_command_index = -1
             for command_prefix, prefix_is_active in command_prefixes.items():
                 if prefix_is_active:
-                    search_index = text.find(command_prefix, start_index)
+                    search_index = text_find(command_prefix, start_index)
                     if search_index == -1:
                         command_prefixes[command_prefix] = False
                     elif maybe_start_cb_command_index == -1 or search_index < maybe_start_cb_command_index:
                         maybe_start_cb_command_index = search_index
             if maybe_start_cb_command_index == -1:
                 break
-            line_num += text.count('\n', start_index, maybe_start_cb_command_index)
-            maybe_end_cb_command_index = maybe_start_cb_command_index + 4
-            for _ in range(max_command_len + 1):
-                if text[maybe_end_cb_command_index:maybe_end_cb_command_index+1] in after_attr_chars:
-                    break
-                maybe_end_cb_command_index += 1
-            else:
+            line_num += text_count('\n', start_index, maybe_start_cb_command_index)
+            # The command ends at the first "}" or whitespace, which must
+            # occur within the length of the longest command
+            maybe_end_cb_command_match = command_end_match(text, maybe_start_cb_command_index + 4)
+            if maybe_end_cb_command_match is None:
                 maybe_end_cb_command_index = -1
-            if maybe_end_cb_command_index == -1:
                 command = None
             else:
+                maybe_end_cb_command_index = maybe_end_cb_command_match.end() - 1
                 command = text[maybe_start_cb_command_index+4:maybe_end_cb_command_index]
                 if command not in commands_set:
                     command = None
@@ -1323,12 +1559,46 @@ class PandocConverter(Converter):
                 # syntax, but that would probably introduce significant
                 # complexity for marginal benefit.
                 maybe_codebraid_attr = True
-            results.append((maybe_start_cb_command_index, line_num, maybe_codebraid_attr, command))
+            results_append((maybe_start_cb_command_index, line_num, maybe_codebraid_attr, command))
         return results
 
 
+    @staticmethod
+    def _load_ast(ast_bytes):
+        try:
+            ast = json_loads(ast_bytes)
+        except Exception as e:
+            raise PandocError('Failed to load AST (incompatible Pandoc version?):\n{0}'.format(e))
+        if not (isinstance(ast, dict) and
+                'pandoc-api-version' in ast and isinstance(ast['pandoc-api-version'], list) and
+                all(isinstance(x, int) for x in ast['pandoc-api-version']) and 'blocks' in ast):
+            raise PandocError('Unrecognized AST format (incompatible Pandoc version?)')
+        return ast
+
+
+    def _load_file_scope_asts(self, *, run_pandoc):
+        '''
+        With `pandoc_file_scope`, convert each origin into a separate AST.
+        Pandoc runs for the different origins are performed concurrently,
+        since they are independent and most of the time is spent waiting on
+        subprocesses.  Results and any Pandoc stderr are kept in origin order.
+        '''
+        max_workers = min(len(self.origins), os.cpu_count() or 1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(run_pandoc, input=origin_string, input_name=origin_name)
+                       for origin_name, origin_string in self.origins.items()]
+            asts = []
+            for future in futures:
+                stdout_bytes, stderr_bytes = future.result()
+                if stderr_bytes:
+                    sys.stderr.buffer.write(stderr_bytes)
+                asts.append(self._load_ast(stdout_bytes))
+        return asts
+
+
     def _load_and_process_initial_ast(self, *,
-                                      origin_string, single_origin_name=None):
+                                      origin_string, single_origin_name=None,
+                                      run_pandoc=None, ast=None):
         '''
         Convert source string into a Pandoc AST and perform a number of
         operations on the AST.
@@ -1342,37 +1612,14 @@ class PandocConverter(Converter):
             These special code nodes are converted back into raw nodes in the
             final AST before the final format conversion.
         '''
-        # Convert source string to AST with Pandoc.
-        # Order of extensions is important: earlier override later.
-        from_format_pandoc_extensions = ['-smart']
-        if self.from_format == 'markdown':
-            from_format_pandoc_extensions.append('-latex_macros')
-        from_format_pandoc_extensions = ''.join(from_format_pandoc_extensions)
-
-        if self.from_format_pandoc_extensions is not None:
-            from_format_pandoc_extensions += self.from_format_pandoc_extensions
-
-        stdout_bytes, stderr_bytes = self._run_pandoc(input=origin_string,
-                                                      input_name=single_origin_name,
-                                                      from_format=self.from_format,
-                                                      from_format_pandoc_extensions=from_format_pandoc_extensions,
-                                                      other_pandoc_args=self.other_pandoc_args_at_load,
-                                                      to_format='json',
-                                                      newline_lf=True,
-                                                      preserve_tabs=True)
-        if self.from_format_pandoc_extensions is not None:
-            self.from_format_pandoc_extensions = self.from_format_pandoc_extensions.replace('+sourcepos', '')
-
-        if stderr_bytes:
-            sys.stderr.buffer.write(stderr_bytes)
-        try:
-            ast = json.loads(stdout_bytes)
-        except Exception as e:
-            raise PandocError('Failed to load AST (incompatible Pandoc version?):\n{0}'.format(e))
-        if not (isinstance(ast, dict) and
-                'pandoc-api-version' in ast and isinstance(ast['pandoc-api-version'], list) and
-                all(isinstance(x, int) for x in ast['pandoc-api-version']) and 'blocks' in ast):
-            raise PandocError('Unrecognized AST format (incompatible Pandoc version?)')
+        # Convert source string to AST with Pandoc, unless the AST has
+        # already been loaded.  `run_pandoc()` has all arguments except for
+        # input already bound.
+        if ast is None:
+            stdout_bytes, stderr_bytes = run_pandoc(input=origin_string, input_name=single_origin_name)
+            if stderr_bytes:
+                sys.stderr.buffer.write(stderr_bytes)
+            ast = self._load_ast(stdout_bytes)
         for k in ('codebraid', 'codebraid_'):
             try:
                 del ast['meta'][k]
@@ -1390,16 +1637,23 @@ class PandocConverter(Converter):
         # the AST.
         code_chunks_in_notes = False
         codebraid_node_set = set()
+        code_chunks_append = self.code_chunks.append
+        codebraid_node_set_add = codebraid_node_set.add
         for node_tuple in code_raw_node_tuples:
             node, parent_node, parent_node_list, parent_node_list_index, in_note = node_tuple
-            node_type = node['t']
-            if node_type.startswith('Code'):
-                if any(c.startswith('cb.') or c.startswith('cb-')for c in node['c'][0][1]):
-                    if in_note:
-                        code_chunks_in_notes = True
-                    code_chunk = PandocCodeChunk(node, parent_node, parent_node_list, parent_node_list_index)
-                    self.code_chunks.append(code_chunk)
-                    codebraid_node_set.add(id(node))
+            if node['t'] in pandoc_code_nodes:
+                # Plain loop rather than `any()`, since this runs for every
+                # code node and most have no Codebraid class
+                for c in node['c'][0][1]:
+                    if c[:3] in codebraid_class_prefixes:
+                        break
+                else:
+                    continue
+                if in_note:
+                    code_chunks_in_notes = True
+                code_chunk = PandocCodeChunk(node, parent_node, parent_node_list, parent_node_list_index)
+                code_chunks_append(code_chunk)
+                codebraid_node_set_add(id(node))
         # Locate all occurrences of `.cb.` in source(s), to provide
         # traceback information for source errors
         if single_origin_name is not None:
@@ -1439,12 +1693,11 @@ class PandocConverter(Converter):
                         sources_cb.append(skipped.pop())
             for node_tuple in code_raw_node_tuples:
                 node, parent_node, parent_node_list, parent_node_list_index, in_note = node_tuple
-                node_type = node['t']
-                if node_type.startswith('Raw'):
+                if pandoc_code_raw_node_kinds[node['t']][0]:
                     if single_origin_name is None:
                         node_format, node_contents = node['c']
                         node_format = node_format.lower()
-                        if node_format == 'html' and node_contents == '<!--codebraid.eof-->':
+                        if node_format == 'html' and node_contents == codebraid_eof_comment:
                             node['t'] = 'Null'
                             del node['c']
                             continue
@@ -1455,21 +1708,23 @@ class PandocConverter(Converter):
             # If notes are present, nodes may be out of order.
             code_chunk_iter = iter(self.code_chunks)
             skipped = []
+            find_cb_command = self._find_cb_command
+            from_format = self.from_format
             for node_tuple in code_raw_node_tuples:
                 node, parent_node, parent_node_list, parent_node_list_index, in_note = node_tuple
-                node_type = node['t']
-                if single_origin_name is None and node_type.startswith('Raw'):
+                node_is_raw, node_is_block = pandoc_code_raw_node_kinds[node['t']]
+                if single_origin_name is None and node_is_raw:
                     node_format, node_contents = node['c']
                     node_format = node_format.lower()
-                    if node_format == 'html' and node_contents == '<!--codebraid.eof-->':
+                    if node_format == 'html' and node_contents == codebraid_eof_comment:
                         node['t'] = 'Null'
                         del node['c']
                         current_origin_name = origin_names_stack.pop()
                         while sources_cb and sources_cb[-1][0] == current_origin_name:
                             sources_cb.pop()
                         continue
-                node_cb = self._find_cb_command(node['c'][1], from_format=self.from_format)
-                if node_cb and not node_type.endswith('Block'):
+                node_cb = find_cb_command(node['c'][1], from_format=from_format)
+                if node_cb and not node_is_block:
                     # Inline:  code comes before attr
                     for _, _, node_maybe_codebraid, node_command in node_cb:
                         src_cb_i = sources_cb.pop()
@@ -1501,7 +1756,7 @@ class PandocConverter(Converter):
                     if skipped:
                         while skipped:
                             sources_cb.append(skipped.pop())
-                if node_cb and node_type.endswith('Block'):
+                if node_cb and node_is_block:
                     # Block:  code comes after attr
                     for _, _, node_maybe_codebraid, node_command in node_cb:
                         src_cb_i = sources_cb.pop()
@@ -1514,23 +1769,54 @@ class PandocConverter(Converter):
                     if skipped:
                         while skipped:
                             sources_cb.append(skipped.pop())
-                if node_type.startswith('Raw'):
+                if node_is_raw:
                     freeze_raw_node(node, '', 0)
 
 
     def _extract_code_chunks(self):
-        if self.pandoc_file_scope or len(self.origins) == 1:
-            for origin_name, origin_string in self.origins.items():
-                self._load_and_process_initial_ast(origin_string=origin_string, single_origin_name=origin_name)
+        # Pandoc arguments for converting sources to ASTs are the same for all
+        # origins, so bind them once.
+        # Order of extensions is important: earlier override later.
+        from_format_pandoc_extensions = ['-smart']
+        if self.from_format == 'markdown':
+            from_format_pandoc_extensions.append('-latex_macros')
+        from_format_pandoc_extensions = ''.join(from_format_pandoc_extensions)
+        if self.from_format_pandoc_extensions is not None:
+            from_format_pandoc_extensions += self.from_format_pandoc_extensions
+        run_pandoc = functools.partial(self._run_pandoc,
+                                       from_format=self.from_format,
+                                       from_format_pandoc_extensions=from_format_pandoc_extensions,
+                                       other_pandoc_args=self.other_pandoc_args_at_load,
+                                       to_format='json',
+                                       newline_lf=True,
+                                       preserve_tabs=True)
+
+        if len(self.origins) == 1:
+            origin_name, origin_string = next(iter(self.origins.items()))
+            self._load_and_process_initial_ast(origin_string=origin_string, single_origin_name=origin_name,
+                                               run_pandoc=run_pandoc)
+        elif self.pandoc_file_scope:
+            asts = self._load_file_scope_asts(run_pandoc=run_pandoc)
+            for (origin_name, origin_string), ast in zip(self.origins.items(), asts):
+                self._load_and_process_initial_ast(origin_string=origin_string, single_origin_name=origin_name,
+                                                   ast=ast)
         else:
-            self._load_and_process_initial_ast(origin_string=self.concat_origin_string)
+            self._load_and_process_initial_ast(origin_string=self.concat_origin_string, run_pandoc=run_pandoc)
+
+        # Source positions are only needed in the initial ASTs
+        if self.from_format_pandoc_extensions is not None:
+            self.from_format_pandoc_extensions = self.from_format_pandoc_extensions.replace('+sourcepos', '')
 
 
     def _generate_final_ast(self):
-        for code_chunk in reversed(self.code_chunks):
-            # Substitute code output into AST in reversed order to preserve
-            # indices
-            code_chunk.update_parent_node()
+        # Substitute code output into AST in order.  Track the number of
+        # nodes added to each parent node list, so that indices of later code
+        # chunks in the same list can be adjusted.
+        parent_node_list_offsets = {}
+        for code_chunk in self.code_chunks:
+            parent_node_list_id = id(code_chunk.parent_node_list)
+            index_offset = parent_node_list_offsets.get(parent_node_list_id, 0)
+            parent_node_list_offsets[parent_node_list_id] = index_offset + code_chunk.update_parent_node(index_offset)
         if self._io_map:
             # Insert tracking spans if needed
             io_map_span_node = self._io_map_span_node
@@ -1550,7 +1836,7 @@ class PandocConverter(Converter):
 
         processed_markup = collections.OrderedDict()
         for origin_name, ast in self._asts.items():
-            markup_bytes, stderr_bytes = self._run_pandoc(input=json.dumps(ast),
+            markup_bytes, stderr_bytes = self._run_pandoc(input=json_dumps(ast),
                                                           from_format='json',
                                                           to_format='markdown',
                                                           to_format_pandoc_extensions=processed_to_format_extensions,
@@ -1588,34 +1874,42 @@ class PandocConverter(Converter):
                                                                  preserve_tabs=True)
                 if stderr_bytes:
                     sys.stderr.buffer.write(stderr_bytes)
-        final_ast = json.loads(final_ast_bytes)
-        self._final_ast = final_ast
 
         if not self._io_map:
-            thaw_raw_node = self._thaw_raw_node
-            for node_tuple in self._walk_ast(final_ast):
-                node, parent_node, parent_node_list, parent_node_list_index, in_note = node_tuple
-                node_type = node['t']
-                if node_type in ('Code', 'CodeBlock') and 'codebraid--temp' in node['c'][0][1]:
-                    thaw_raw_node(node)
+            # The final AST is only needed for conversion to the output
+            # format, so keep it serialized.  It only needs to be loaded and
+            # reserialized if there are frozen raw nodes to thaw.
+            if b'"codebraid--temp"' in final_ast_bytes:
+                final_ast = json_loads(final_ast_bytes)
+                thaw_raw_node = self._thaw_raw_node
+                # Only code nodes are yielded, so that the walk doesn't need
+                # to create a tuple for every node in the document
+                for node_tuple in self._walk_ast(final_ast, type_filter=pandoc_code_nodes):
+                    node = node_tuple[0]
+                    if 'codebraid--temp' in node['c'][0][1]:
+                        thaw_raw_node(node)
+                final_ast_bytes = json_dumps(final_ast)
+            self._final_ast_bytes = final_ast_bytes
         else:
+            final_ast = json_loads(final_ast_bytes)
+            self._final_ast = final_ast
             io_tracker_nodes = []
             io_map_span_node_to_raw_tracker = self._io_map_span_node_to_raw_tracker
             thaw_raw_node = self._thaw_raw_node_io_map
-            for node_tuple in self._walk_ast(final_ast):
-                node, parent_node_list, parent_node_list_index = node_tuple
-                node_type = node['t']
-                if node_type == 'Span' and 'codebraid--temp' in node['c'][0][1]:
-                    io_map_span_node_to_raw_tracker(node)
-                    io_tracker_nodes.append(node)
-                if node_type in ('Code', 'CodeBlock') and 'codebraid--temp' in node['c'][0][1]:
-                    thaw_raw_node(node)
+            for node_tuple in self._walk_ast(final_ast, type_filter=pandoc_code_span_nodes):
+                node = node_tuple[0]
+                if 'codebraid--temp' in node['c'][0][1]:
+                    if node['t'] == 'Span':
+                        io_map_span_node_to_raw_tracker(node)
+                        io_tracker_nodes.append(node)
+                    else:
+                        thaw_raw_node(node)
             self._io_tracker_nodes = io_tracker_nodes
 
 
     def _convert(self, *, to_format, output_path=None, overwrite=False,
                 standalone=None, other_pandoc_args=None):
-        if self._final_ast is None:
+        if self._final_ast is None and self._final_ast_bytes is None:
             self._generate_final_ast()
 
         if to_format is None:
@@ -1641,7 +1935,7 @@ class PandocConverter(Converter):
             raise RuntimeError('Output path "{0}" exists, but overwrite=False'.format(output_path))
 
         if not self._io_map:
-            converted_bytes, stderr_bytes = self._run_pandoc(input=json.dumps(self._final_ast),
+            converted_bytes, stderr_bytes = self._run_pandoc(input=self._final_ast_bytes,
                                                              from_format='json',
                                                              to_format=to_format,
                                                              to_format_pandoc_extensions=to_format_pandoc_extensions,
@@ -1656,7 +1950,7 @@ class PandocConverter(Converter):
         else:
             for node in self._io_tracker_nodes:
                 node['c'][0] = to_format
-            converted_bytes, stderr_bytes = self._run_pandoc(input=json.dumps(self._final_ast),
+            converted_bytes, stderr_bytes = self._run_pandoc(input=json_dumps(self._final_ast),
                                                              from_format='json',
                                                              to_format=to_format,
                                                              to_format_pandoc_extensions=to_format_pandoc_extensions,
@@ -1668,20 +1962,18 @@ class PandocConverter(Converter):
                 sys.stderr.buffer.write(stderr_bytes)
             converted_lines = util.splitlines_lf(converted_bytes.decode(encoding='utf8')) or ['']
             converted_to_source_dict = {}
-            trace_re = re.compile(r'\x02CodebraidTrace\(.+?:\d+\)\x03')
+            trace_re_sub = codebraid_trace_re.sub
             for index, line in enumerate(converted_lines):
+                #  Tracking format:  '\x02CodebraidTrace({0})\x03'
+                line_before, trace_open, trace_and_line_after = line.partition(codebraid_trace_open)
+                if not trace_open:
+                    continue
+                trace, _, line_after = trace_and_line_after.partition(codebraid_trace_close)
+                line = line_before + line_after
+                converted_to_source_dict[str(index + 1)] = trace
                 if '\x02' in line:
-                    #  Tracking format:  '\x02CodebraidTrace({0})\x03'
-                    line_split = line.split('\x02CodebraidTrace(', 1)
-                    if len(line_split) == 1:
-                        continue
-                    line_before, trace_and_line_after = line_split
-                    trace, line_after = trace_and_line_after.split(')\x03', 1)
-                    line = line_before + line_after
-                    converted_to_source_dict[str(index + 1)] = trace
-                    if '\x02' in line:
-                        line = trace_re.sub('', line)
-                    converted_lines[index] = line
+                    line = trace_re_sub('', line)
+                converted_lines[index] = line
             converted_lines[-1] = converted_lines[-1] + '\n'
             converted = '\n'.join(converted_lines)
             if self.synctex:
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2022, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+import json
+import shutil
+import subprocess
+
+import pytest
+
+from codebraid import converters
+from codebraid.converters.pandoc import PandocConverter, walk_node_list
+
+
+requires_pandoc = pytest.mark.skipif(shutil.which('pandoc') is None, reason='Pandoc is not installed')
+
+
+def data_positions(node_list):
+    for node, *_ in walk_node_list(node_list, None):
+        contents = node.get('c')
+        if isinstance(contents, list) and contents and isinstance(contents[0], list) and len(contents[0]) == 3:
+            for kv in contents[0][2]:
+                if isinstance(kv, list) and kv[0] == 'data-pos':
+                    yield kv[1]
+
+
+def convert_to_ast(tmp_path, **kwargs):
+    output_path = tmp_path / 'output.json'
+    with converters.PandocConverter(no_cache=True, cache_path=tmp_path / '_codebraid', **kwargs) as converter:
+        converter.convert(to_format='json', output_path=output_path, standalone=False)
+    return json.loads(output_path.read_text(encoding='utf8'))
+
+
+
+
+def test_walk_node_list_in_note():
+    inside = {'t': 'Code', 'c': [['', [], []], 'inside']}
+    after = {'t': 'Code', 'c': [['', [], []], 'after']}
+    blocks = [
+        {
+            't': 'Para',
+            'c': [
+                {'t': 'Str', 'c': 'text'},
+                {'t': 'Note', 'c': [{'t': 'Para', 'c': [inside]}]},
+                {'t': 'Space'},
+                after,
+            ]
+        },
+    ]
+    ast = {'blocks': blocks}
+    in_note = {node['c'][1]: in_note for node, _, _, _, in_note in walk_node_list(blocks, ast, {'Code'})}
+    assert in_note == {'inside': True, 'after': False}
+
+    nodes = [node['c'][1] for node, *_ in walk_node_list(blocks, ast, {'Code'}, skip_note_contents=True)]
+    assert nodes == ['after']
+
+
+
+@requires_pandoc
+def test_update_parent_node_index_offsets(tmp_path):
+    # Several code chunks in the same parent node lists, each expanding to a
+    # different number of nodes, so that each update depends on the offsets
+    # from earlier updates
+    string = '''\
+Text `print(1)`{.python .cb-run show=none} a `print(2)`{.python .cb-run} b \
+`print(3)`{.python .cb-run show=code+stdout} c `print(4)`{.python .cb-run} end.
+
+```{.python .cb-run show=none}
+x = 1
+```
+
+```{.python .cb-run show=code+stdout}
+print(5)
+```
+
+Middle.
+
+```{.python .cb-run}
+print(6)
+```
+
+Last.
+'''
+    ast = convert_to_ast(tmp_path, strings=string, from_format='markdown')
+    blocks = ast['blocks']
+    inline_contents = [node['c'] if node['t'] == 'Str' else (node['c'][0][1], node['c'][1])
+                       for node in blocks[0]['c'] if node['t'] in ('Str', 'Code')]
+    assert inline_contents == ['Text', 'a', '2', 'b', (['python'], 'print(3)'), (['stdout'], '3'), 'c', '4', 'end.']
+    block_contents = [(node['t'], node['c'][1] if node['t'] == 'CodeBlock' else node['c'][0]['c'])
+                      for node in blocks[1:]]
+    assert block_contents == [('CodeBlock', 'print(5)'), ('CodeBlock', '5'), ('Para', 'Middle.'),
+                              ('Para', '6'), ('Para', 'Last.')]
+
+
+
+@requires_pandoc
+@pytest.mark.parametrize('strings,pandoc_file_scope', [
+    (['# First\n\nSome *text*.\n'], False),
+    (['# First\n\nSome *text*.\n', 'Second `code`.\n\n* item\n'], True),
+])
+def test_sourcepos_only_in_initial_asts(tmp_path, monkeypatch, strings, pandoc_file_scope):
+    # `+sourcepos` applies to the initial conversion of every origin, but not
+    # to the Markdown round trip that produces the final AST.  Pandoc's
+    # Markdown reader doesn't support `sourcepos`, and positions in the
+    # intermediate Markdown would not correspond to the sources.
+    run_pandoc_calls = []
+    run_pandoc = PandocConverter._run_pandoc
+    def run_pandoc_spy(self, **kwargs):
+        run_pandoc_calls.append(kwargs)
+        return run_pandoc(self, **kwargs)
+    monkeypatch.setattr(PandocConverter, '_run_pandoc', run_pandoc_spy)
+
+    string_origins = [f'source_{n}.md' for n in range(len(strings))]
+    ast = convert_to_ast(tmp_path, strings=strings, string_origins=string_origins,
+                         from_format='commonmark_x+sourcepos', pandoc_file_scope=pandoc_file_scope)
+
+    load_calls = [kwargs for kwargs in run_pandoc_calls if kwargs['from_format'] == 'commonmark_x']
+    assert len(load_calls) == len(strings)
+    assert all('+sourcepos' in kwargs['from_format_pandoc_extensions'] for kwargs in load_calls)
+    roundtrip_calls = [kwargs for kwargs in run_pandoc_calls if kwargs['from_format'] == 'markdown']
+    assert roundtrip_calls
+    assert not any('sourcepos' in (kwargs.get('from_format_pandoc_extensions') or '') for kwargs in roundtrip_calls)
+
+    # Source positions from the sources themselves are kept as Pandoc
+    # created them, so the final AST contains only those positions
+    source_positions = set()
+    for string in strings:
+        source_ast = json.loads(subprocess.run(['pandoc', '-f', 'commonmark_x+sourcepos', '-t', 'json'],
+                                               input=string.encode('utf8'), stdout=subprocess.PIPE,
+                                               check=True).stdout)
+        source_positions.update(data_positions(source_ast['blocks']))
+    final_positions = set(data_positions(ast['blocks']))
+    assert final_positions
+    assert final_positions <= source_positions